@@ -1,30 +1,141 @@
 """
 Handles parsing of scraped HTML content from grants.gov
 """
-from typing import List, Dict, Any, Optional
-from bs4 import BeautifulSoup
+from io import BytesIO
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+from lxml import etree
+from lxml.html import soupparser
 from utilities import setup_logger
+import logging
 import re
 
 logger = setup_logger(__name__)
 
-def safe_extract_text(element: Optional[BeautifulSoup], class_name: str) -> Optional[str]:
+# Matches runs of anything that is not part of a numeric amount
+_AMOUNT_RE = re.compile(r'[^\d.]+')
+
+def _has_class(class_name: str) -> str:
+    """Build an XPath predicate matching one token of an element's class attribute"""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')"
+
+def _find(element: etree._Element, xpath: etree.XPath) -> Optional[etree._Element]:
+    """Return the first element matching a compiled XPath expression, or None"""
+    matches = xpath(element)
+    return matches[0] if matches else None
+
+# Selectors are compiled once at import time rather than once per row
+_SEL_RESULTS_TABLE = etree.XPath(f"//table[{_has_class('usa-table')}]")
+_SEL_ROWS = etree.XPath(".//tr")
+_SEL_ENCLOSING_RESULTS_TABLE = etree.XPath(f"ancestor::table[1][{_has_class('usa-table')}]")
+_SEL_OPPORTUNITY_LINK = etree.XPath(f".//a[{_has_class('usa-link')}]")
+_SEL_GRANT_DETAILS = etree.XPath(f".//div[{_has_class('grant-details')}]")
+_SEL_AWARD_INFO = etree.XPath(f".//div[{_has_class('award-info')}]")
+_SEL_CEILING = etree.XPath(f".//span[{_has_class('ceiling')}]")
+_SEL_FLOOR = etree.XPath(f".//span[{_has_class('floor')}]")
+_SEL_ELIGIBILITY = etree.XPath(f".//div[{_has_class('eligibility')}]")
+_SEL_FUNDING_INSTRUMENT = etree.XPath(f".//div[{_has_class('funding-instrument')}]")
+_SEL_CATEGORY = etree.XPath(f".//div[{_has_class('category')}]")
+_SEL_BODY_ROWS = etree.XPath(".//tbody//tr")
+_SEL_ROW_LINK = etree.XPath(f"./td//a[{_has_class('usa-link')}]")
+
+# Grant details page: each section header resolves straight to the table that follows it
+_SECTIONS = (
+    ("general", "General Information"),
+    ("eligibility", "Eligibility"),
+    ("additional", "Additional Information"),
+)
+_SEL_SYNOPSIS = etree.XPath("//h2[normalize-space()='Opportunity Synopsis']/following::div[1]")
+_SECTION_XPATHS = tuple(
+    (name, etree.XPath(f"//h2[normalize-space()={header!r}]/following::table[1]"))
+    for name, header in _SECTIONS
+)
+
+def _parse_html(html_content: str) -> etree._Element:
     """
-    Safely extract text from a BeautifulSoup element
+    Parse HTML into an lxml tree, falling back to BeautifulSoup for malformed pages
     
     Args:
-        element: BeautifulSoup element to extract from
+        html_content: Raw HTML content
+        
+    Returns:
+        etree._Element: Root element of the parsed document
+    """
+    try:
+        # Parse from bytes so pages carrying an XML encoding declaration are accepted
+        root = etree.HTML(html_content.encode('utf-8'), etree.HTMLParser(encoding='utf-8'))
+        if root is not None:
+            return root
+        logger.warning("lxml returned an empty document, falling back to BeautifulSoup")
+    except (etree.LxmlError, ValueError) as e:
+        logger.warning(f"lxml failed to parse HTML, falling back to BeautifulSoup: {e}")
+    return soupparser.fromstring(html_content)
+
+def _iter_result_rows(html_content: str) -> Iterator[etree._Element]:
+    """
+    Stream the rows of the first results table, skipping its header row
+    
+    Rows are read with lxml's event-driven iterparse and discarded once the
+    caller has consumed them, so memory stays flat regardless of table size.
+    
+    Args:
+        html_content: Raw HTML content from the search results page
+        
+    Yields:
+        etree._Element: Table row elements
+    """
+    results_table = None
+    rows_seen = 0
+    try:
+        events = etree.iterparse(
+            BytesIO(html_content.encode('utf-8')),
+            events=('end',), tag='tr', html=True, encoding='utf-8'
+        )
+        for _, row in events:
+            table = _find(row, _SEL_ENCLOSING_RESULTS_TABLE)
+            if table is None:
+                continue
+            if results_table is None:
+                results_table = table
+            elif table is not results_table:
+                continue
+
+            rows_seen += 1
+            if rows_seen == 1:
+                continue  # Skip header row
+
+            yield row
+
+            # Free the consumed row and everything before it
+            row.clear()
+            while row.getprevious() is not None:
+                del row.getparent()[0]
+    except etree.LxmlError as e:
+        if rows_seen:
+            raise
+        logger.warning(f"Streaming parse failed, falling back to full document parse: {e}")
+        table = _find(_parse_html(html_content), _SEL_RESULTS_TABLE)
+        if table is not None:
+            yield from _SEL_ROWS(table)[1:]
+
+def safe_extract_text(element: Optional[etree._Element], class_name: str) -> Optional[str]:
+    """
+    Safely extract text from an lxml element
+    
+    Args:
+        element: lxml element to extract from
         class_name: Class name for logging context
         
     Returns:
         Optional[str]: Extracted text or None if extraction fails
     """
-    if not element:
-        logger.debug(f"No element found for {class_name}")
+    if element is None:
+        logger.debug("No element found for %s", class_name)
         return None
         
     try:
-        text = element.text.strip()
+        # A leaf element's text is its only text node, so skip the join
+        text = element.text if len(element) == 0 else "".join(element.itertext())
+        text = text.strip() if text else None
         return text if text else None
     except AttributeError as e:
         logger.warning(f"Failed to extract text from {class_name}: {e}")
@@ -38,7 +149,7 @@ def clean_amount(amount_str: Optional[str]) -> Optional[str]:
         return None
     try:
         # Remove currency symbols, commas, and whitespace
-        cleaned = re.sub(r'[^\d.]', '', amount_str)
+        cleaned = _AMOUNT_RE.sub('', amount_str)
         return cleaned if cleaned else None
     except Exception as e:
         logger.warning(f"Failed to clean amount string '{amount_str}': {e}")
@@ -63,6 +174,34 @@ def validate_grant_data(grant_data: Dict[str, Any]) -> bool:
     
     return True
 
+def parse_grant_links(html_content: str) -> List[Tuple[str, str]]:
+    """
+    Parses opportunity numbers and detail links from a search results table.
+    
+    Args:
+        html_content: HTML of the results table, e.g. its outerHTML
+        
+    Returns:
+        List[Tuple[str, str]]: (opportunity number, href) pairs in table order
+    """
+    if not html_content:
+        logger.warning("Empty HTML content provided")
+        return []
+
+    links = []
+    for row in _SEL_BODY_ROWS(_parse_html(html_content)):
+        link = _find(row, _SEL_ROW_LINK)
+        if link is None:
+            logger.warning("No opportunity link found in results row")
+            continue
+        opportunity_number = "".join(link.itertext()).strip()
+        href = link.get("href", "").strip()
+        if not href:
+            logger.warning(f"No detail URL found for opportunity {opportunity_number}")
+            continue
+        links.append((opportunity_number, href))
+    return links
+
 def parse_search_results(html_content: str) -> List[Dict[str, Any]]:
     """
     Parses HTML content from grants.gov search results table.
@@ -80,31 +219,23 @@ def parse_search_results(html_content: str) -> List[Dict[str, Any]]:
     grants = []
     try:
         logger.info("Starting to parse search results")
-        soup = BeautifulSoup(html_content, 'html.parser')
-        table = soup.find('table', class_='usa-table')
-        
-        if not table:
-            logger.warning("No results table found in HTML content")
-            return []
-            
-        rows = table.find_all('tr')[1:]  # Skip header row
-        logger.info(f"Found {len(rows)} grant rows to parse")
-        
-        for idx, row in enumerate(rows, 1):
+        idx = 0
+        for idx, row in enumerate(_iter_result_rows(html_content), 1):
             try:
-                logger.debug(f"Parsing row {idx}/{len(rows)}")
-                cols = row.find_all("td")
+                logger.debug("Parsing row %s", idx)
+                cols = row.findall("td")
                 if len(cols) < 6:
                     logger.warning(f"Skipping row with insufficient columns: {len(cols)}")
                     continue
+                link_cell, title_cell, agency_cell, status_cell, posted_cell, close_cell, *_ = cols
 
                 # Extract opportunity number and detail page URL more carefully
-                opportunity_link = cols[0].find("a", class_="usa-link")
-                if not opportunity_link:
+                opportunity_link = _find(link_cell, _SEL_OPPORTUNITY_LINK)
+                if opportunity_link is None:
                     logger.warning(f"No opportunity link found in row {idx}")
                     continue
                     
-                opportunity_number = opportunity_link.text.strip()
+                opportunity_number = "".join(opportunity_link.itertext()).strip()
                 detail_url = opportunity_link.get("href", "").strip()
                 
                 if not detail_url:
@@ -113,45 +244,45 @@ def parse_search_results(html_content: str) -> List[Dict[str, Any]]:
                     
                 # Build full URL
                 detail_url = f"https://grants.gov{detail_url}"
-                logger.debug(f"Found detail URL for {opportunity_number}: {detail_url}")
+                logger.debug("Found detail URL for %s: %s", opportunity_number, detail_url)
 
                 # Extract basic grant information
                 grant = {
                     "opportunity_number": opportunity_number,
                     "detail_page_url": detail_url,
-                    "title": safe_extract_text(cols[1], "title"),
-                    "agency": safe_extract_text(cols[2], "agency"),
-                    "status": safe_extract_text(cols[3], "status"),
-                    "posted_date": safe_extract_text(cols[4], "posted_date"),
-                    "close_date": safe_extract_text(cols[5], "close_date"),
+                    "title": safe_extract_text(title_cell, "title"),
+                    "agency": safe_extract_text(agency_cell, "agency"),
+                    "status": safe_extract_text(status_cell, "status"),
+                    "posted_date": safe_extract_text(posted_cell, "posted_date"),
+                    "close_date": safe_extract_text(close_cell, "close_date"),
                 }
 
                 # Extract additional fields if available
                 try:
-                    details_div = cols[1].find('div', class_='grant-details')
-                    if details_div:
+                    details_div = _find(title_cell, _SEL_GRANT_DETAILS)
+                    if details_div is not None:
                         # Extract award information
-                        award_info = details_div.find('div', class_='award-info')
-                        if award_info:
+                        award_info = _find(details_div, _SEL_AWARD_INFO)
+                        if award_info is not None:
                             grant["award_ceiling"] = clean_amount(
-                                safe_extract_text(award_info.find('span', class_='ceiling'), "award_ceiling")
+                                safe_extract_text(_find(award_info, _SEL_CEILING), "award_ceiling")
                             )
                             grant["award_floor"] = clean_amount(
-                                safe_extract_text(award_info.find('span', class_='floor'), "award_floor")
+                                safe_extract_text(_find(award_info, _SEL_FLOOR), "award_floor")
                             )
 
                         # Extract additional metadata
                         grant["eligibility"] = safe_extract_text(
-                            details_div.find('div', class_='eligibility'), "eligibility"
+                            _find(details_div, _SEL_ELIGIBILITY), "eligibility"
                         )
                         grant["funding_instrument"] = safe_extract_text(
-                            details_div.find('div', class_='funding-instrument'), "funding_instrument"
+                            _find(details_div, _SEL_FUNDING_INSTRUMENT), "funding_instrument"
                         )
                         grant["category"] = safe_extract_text(
-                            details_div.find('div', class_='category'), "category"
+                            _find(details_div, _SEL_CATEGORY), "category"
                         )
                 except Exception as e:
-                    logger.debug(f"Could not extract additional fields for grant {opportunity_number}: {e}")
+                    logger.debug("Could not extract additional fields for grant %s: %s", opportunity_number, e)
 
                 # Validate all required fields
                 if not validate_grant_data(grant):
@@ -159,19 +290,76 @@ def parse_search_results(html_content: str) -> List[Dict[str, Any]]:
                     continue
 
                 grants.append(grant)
-                logger.debug(f"Successfully parsed grant {opportunity_number} with {len(grant)} fields")
+                logger.debug("Successfully parsed grant %s with %s fields", opportunity_number, len(grant))
 
             except Exception as e:
-                logger.error(f"Error parsing row {idx}: {e}", exc_info=True)
+                # Only pay for the traceback when debugging
+                logger.error("Error parsing row %s: %s", idx, e, exc_info=logger.isEnabledFor(logging.DEBUG))
                 continue
 
-        logger.info(f"Successfully parsed {len(grants)} grants with detail URLs")
+        if not idx:
+            logger.warning("No results table rows found in HTML content")
+            return []
+
+        logger.info(f"Successfully parsed {len(grants)} of {idx} rows into grants with detail URLs")
         return grants
 
     except Exception as e:
         logger.error(f"Error parsing search results: {e}", exc_info=True)
         return []
 
+def extract_table_data(root: etree._Element, section_name: str, table_xpath: etree.XPath) -> Dict[str, Any]:
+    """
+    Extract key/value rows from one section table of a grant details page
+    
+    Args:
+        root: Root element of the parsed details page
+        section_name: Section name for logging context
+        table_xpath: Compiled XPath resolving the section's table
+        
+    Returns:
+        Dict[str, Any]: Field values keyed by row label, empty if the section is missing
+    """
+    section_data = {}
+    try:
+        table = _find(root, table_xpath)
+        if table is None:
+            logger.debug("No table found for %s section", section_name)
+            return {}
+
+        for row in table.iter("tr"):
+            cols = row.findall("td")
+            if len(cols) != 2:
+                logger.debug("Skipping malformed row in %s", section_name)
+                continue
+
+            key = "".join(cols[0].itertext()).strip().rstrip(':')
+            value_cell = cols[1]
+
+            # Check for links first
+            links = list(value_cell.iter("a"))
+            if links:
+                value = {
+                    "text": "".join(value_cell.itertext()).strip() or None,
+                    "urls": [link.get("href", "").strip() for link in links if link.get("href")]
+                }
+            else:
+                # Handle multi-line text
+                value = "\n".join(
+                    line.strip() 
+                    for line in value_cell.itertext()
+                    if line.strip()
+                ) or None
+
+            if value:
+                section_data[key] = value
+                logger.debug("Extracted %s from %s", key, section_name)
+
+    except Exception as e:
+        logger.error(f"Error extracting {section_name} data: {e}")
+
+    return section_data
+
 def parse_grant_details(html_content: str) -> Dict[str, Any]:
     """
     Parses detailed grant information from a grant's details page.
@@ -188,86 +376,21 @@ def parse_grant_details(html_content: str) -> Dict[str, Any]:
 
     try:
         logger.info("Starting to parse grant details")
-        soup = BeautifulSoup(html_content, 'html.parser')
+        root = _parse_html(html_content)
         details = {}
 
         # Look for synopsis in the correct section
         try:
-            synopsis_header = soup.find('h2', string='Opportunity Synopsis')
-            if synopsis_header:
-                synopsis_section = synopsis_header.find_next('div')
-                if synopsis_section:
-                    details['synopsis'] = synopsis_section.text.strip()
-                    logger.debug("Successfully extracted synopsis")
+            synopsis_section = _find(root, _SEL_SYNOPSIS)
+            if synopsis_section is not None:
+                details['synopsis'] = "".join(synopsis_section.itertext()).strip()
+                logger.debug("Successfully extracted synopsis")
         except Exception as e:
             logger.debug(f"Could not extract synopsis: {e}")
 
-        # Define sections to extract with their headers
-        sections = {
-            "general": {
-                "header": "General Information",
-                "required_fields": []
-            },
-            "eligibility": {
-                "header": "Eligibility",
-                "required_fields": ["Eligible Applicants"]
-            },
-            "additional": {
-                "header": "Additional Information",
-                "required_fields": []
-            }
-        }
-
-        def extract_table_data(soup: BeautifulSoup, section_name: str, header_text: str) -> Dict[str, Any]:
-            """Helper function to extract and validate section data"""
-            section_data = {}
-            try:
-                header = soup.find('h2', string=header_text)
-                if not header:
-                    logger.debug(f"Could not find {header_text} section")
-                    return {}
-
-                table = header.find_next("table")
-                if not table:
-                    logger.debug(f"No table found for {header_text} section")
-                    return {}
-
-                for row in table.find_all("tr"):
-                    cols = row.find_all("td")
-                    if len(cols) != 2:
-                        logger.debug(f"Skipping malformed row in {section_name}")
-                        continue
-
-                    key = cols[0].text.strip().rstrip(':')
-                    value_cell = cols[1]
-                    
-                    # Check for links first
-                    links = value_cell.find_all("a")
-                    if links:
-                        value = {
-                            "text": value_cell.text.strip() or None,
-                            "urls": [link.get("href", "").strip() for link in links if link.get("href")]
-                        }
-                    else:
-                        # Handle multi-line text
-                        value = "\n".join(
-                            line.strip() 
-                            for line in value_cell.stripped_strings
-                        ) or None
-
-                    if value:
-                        section_data[key] = value
-                        logger.debug(f"Extracted {key} from {section_name}")
-
-            except Exception as e:
-                logger.error(f"Error extracting {section_name} data: {e}")
-                
-            return section_data
-
         # Extract data from each section
-        for section_name, section_info in sections.items():
-            section_data = extract_table_data(soup, section_name, section_info["header"])
-            details.update(section_data)
+        for section_name, table_xpath in _SECTION_XPATHS:
+            details.update(extract_table_data(root, section_name, table_xpath))
 
         return details
 
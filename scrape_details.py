@@ -1,23 +1,72 @@
+import argparse
+import asyncio
 import csv
-import time
+import itertools
+import json
 import logging
+import multiprocessing
+import os
+import signal
+from multiprocessing.util import Finalize
+import httpx
 from selenium import webdriver
 from selenium.webdriver.firefox.options import Options
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
+from selenium.common.exceptions import TimeoutException
 from bs4 import BeautifulSoup
 from parser import parse_grant_details  # Importing our proven parsing logic
+from utilities import retry_request
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
+logging.getLogger("httpx").setLevel(logging.WARNING)  # Per-request logs would drown out progress
+
+SYNOPSIS_HEADER_XPATH = "//h2[normalize-space()='Opportunity Synopsis']"
+
+MAX_CONCURRENCY = 32  # Concurrent detail page fetches
+MAX_PENDING = 2 * MAX_CONCURRENCY  # Grants being fetched or parsed at any one time
+JS_WORKERS = 4  # Browser processes for the --js pass
+REQUEST_TIMEOUT = 30  # Seconds per HTTP request
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))  # Responses worth asking for again
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+# Columns of grant_details.csv, declared up front so rows can be streamed as they are scraped
+DETAIL_FIELDNAMES = [
+    "opportunity_number", "detail_page_url", "synopsis",
+    # General Information
+    "Document Type", "Funding Opportunity Number", "Funding Opportunity Title",
+    "Opportunity Category", "Opportunity Category Explanation", "Funding Instrument Type",
+    "Category of Funding Activity", "Category Explanation", "Expected Number of Awards",
+    "Assistance Listings", "Cost Sharing or Matching Requirement", "Version",
+    "Posted Date", "Last Updated Date", "Original Closing Date for Applications",
+    "Current Closing Date for Applications", "Archive Date",
+    "Estimated Total Program Funding", "Award Ceiling", "Award Floor",
+    # Eligibility
+    "Eligible Applicants", "Additional Information on Eligibility",
+    # Additional Information
+    "Agency Name", "Description", "Link to Additional Information",
+    "Grantor Contact Information",
+]
+EXTRA_FIELDS_COLUMN = "extra_fields"  # JSON object of any fields not declared above
+_DETAIL_FIELDS = frozenset(DETAIL_FIELDNAMES)
 
 # Setup WebDriver for Firefox
 def setup_driver():
     """Set up and return the Firefox WebDriver."""
     options = Options()
     options.add_argument("--headless")  # Run in headless mode for efficiency
+
+    # Skip subresources the parser never looks at
+    options.set_preference("permissions.default.image", 2)
+    options.set_preference("permissions.default.stylesheet", 2)
+    options.set_preference("gfx.downloadable_fonts.enabled", False)
+
+    # Let Firefox's built-in tracking protection block ad and analytics requests
+    options.set_preference("privacy.trackingprotection.enabled", True)
+    options.set_preference("privacy.trackingprotection.socialtracking.enabled", True)
     
     try:
         driver = webdriver.Firefox(options=options)
@@ -29,8 +78,8 @@ def setup_driver():
 
 # Function to load grant IDs from CSV
 def load_grant_urls(filename="grant_ids.csv"):
-    """Load grant IDs and URLs from CSV file."""
-    grants = []
+    """Lazily yield grant IDs and URLs from CSV file."""
+    count = 0
     try:
         with open(filename, "r", encoding="utf-8") as file:
             reader = csv.reader(file)
@@ -38,19 +87,63 @@ def load_grant_urls(filename="grant_ids.csv"):
             for row in reader:
                 if len(row) < 2:
                     continue
-                grants.append({"opportunity_number": row[0], "url": row[1]})
-        logger.info(f"Loaded {len(grants)} grant URLs from {filename}")
+                count += 1
+                yield {"opportunity_number": row[0], "url": row[1]}
+        logger.info(f"Loaded {count} grant URLs from {filename}")
     except Exception as e:
         logger.error(f"Error loading grant URLs: {e}")
-    return grants
 
-# Function to scrape grant details
+# Function to classify fetch errors worth retrying
+def is_transient_error(error):
+    """Return True for network failures and throttled or server-error responses."""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRY_STATUSES
+    return isinstance(error, httpx.TransportError)
+
+# Function to download a page, retrying transient failures
+@retry_request(max_retries=3, delay=2.0, should_retry=is_transient_error)
+async def fetch_html(client, url):
+    """Download a page and return its HTML."""
+    response = await client.get(url)
+    response.raise_for_status()
+    return response.text
+
+# Function to fetch grant details over plain HTTP
+async def fetch_grant_details(grant, client, semaphore):
+    """Fetch grant detail page over HTTP and extract data."""
+    try:
+        async with semaphore:
+            html_content = await fetch_html(client, grant["url"])
+
+        # Parse in a worker thread so the next fetches proceed meanwhile
+        loop = asyncio.get_running_loop()
+        details = await loop.run_in_executor(None, parse_grant_details, html_content)
+        if not details:
+            logger.warning(f"No details found over HTTP for {grant['opportunity_number']}")
+            return None
+
+        # Add opportunity number and URL
+        details["opportunity_number"] = grant["opportunity_number"]
+        details["detail_page_url"] = grant["url"]
+
+        logger.info(f"Fetched details for {grant['opportunity_number']}")
+        return details
+    except Exception as e:
+        logger.error(f"Error fetching {grant['opportunity_number']}: {e}")
+        return None
+
+# Function to scrape grant details with a browser, for pages that need JavaScript
 def scrape_grant_details(grant, driver):
     """Visit grant detail page and extract data."""
     try:
         driver.get(grant["url"])
-        WebDriverWait(driver, 15).until(EC.presence_of_element_located((By.TAG_NAME, "body")))
-        time.sleep(2)  # Allow content to load
+        try:
+            # Wait for the rendered synopsis rather than a fixed delay
+            WebDriverWait(driver, 15).until(
+                EC.presence_of_element_located((By.XPATH, SYNOPSIS_HEADER_XPATH))
+            )
+        except TimeoutException:
+            logger.warning(f"Synopsis did not render for {grant['opportunity_number']}, parsing page as loaded")
         
         html_content = driver.page_source
         details = parse_grant_details(html_content)  # Using our proven parser
@@ -65,43 +158,182 @@ def scrape_grant_details(grant, driver):
         logger.error(f"Error scraping {grant['opportunity_number']}: {e}")
         return None
 
-# Function to save grant details to CSV
-def save_to_csv(data, filename="grant_details.csv"):
-    """Save scraped grant details to CSV."""
+# Streaming writer for the grant details CSV
+class GrantDetailsWriter:
+    """Stream grant details to CSV, creating the file only once the first grant arrives."""
+
+    def __init__(self, filename="grant_details.csv"):
+        self.filename = filename
+        self.saved = 0
+        self._file = None
+        self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, details):
+        """Write a grant's details as one CSV row, folding undeclared fields into the extra column."""
+        if self._writer is None:
+            # Line buffered so every grant reaches disk as soon as it is written
+            self._file = open(self.filename, "w", newline="", encoding="utf-8", buffering=1)
+            self._writer = csv.DictWriter(self._file, fieldnames=DETAIL_FIELDNAMES + [EXTRA_FIELDS_COLUMN])
+            self._writer.writeheader()
+
+        row = {}
+        extra = {}
+        for key, value in details.items():
+            if key in _DETAIL_FIELDS:
+                # Nested values use the same JSON encoding as the extra column
+                if isinstance(value, (dict, list)):
+                    value = json.dumps(value, ensure_ascii=False)
+                row[key] = value
+            else:
+                extra[key] = value
+        if extra:
+            row[EXTRA_FIELDS_COLUMN] = json.dumps(extra, ensure_ascii=False)
+        self._writer.writerow(row)
+        self.saved += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+# Per-process WebDriver for the --js worker pool
+_worker_driver = None
+
+def _init_worker():
+    """Start the WebDriver this pool process reuses for every grant it scrapes."""
+    global _worker_driver
+    try:
+        _worker_driver = setup_driver()
+    except Exception:
+        # Leave the worker alive so the pool does not respawn it forever
+        _worker_driver = None
+        return
+    Finalize(_worker_driver, _worker_driver.quit, exitpriority=16)
+    # Pool.terminate() sends SIGTERM, which skips finalizers, so quit the browser here too
+    signal.signal(signal.SIGTERM, _quit_worker_driver)
+
+def _quit_worker_driver(signum, frame):
+    """Quit this process's WebDriver, then exit without running finalizers again."""
+    try:
+        _worker_driver.quit()
+    finally:
+        os._exit(128 + signum)
+
+def _worker_scrape(grant):
+    """Scrape one grant with this process's WebDriver."""
+    if _worker_driver is None:
+        logger.error(f"No WebDriver available to scrape {grant['opportunity_number']}")
+        return None
+    return scrape_grant_details(grant, _worker_driver)
+
+# Function to scrape grant details in parallel browsers
+def scrape_all_with_browsers(grants, writer, workers=JS_WORKERS):
+    """Scrape grants with a pool of Selenium browsers and write them."""
+    pool = multiprocessing.Pool(min(workers, len(grants)), initializer=_init_worker)
     try:
-        if not data:
-            logger.warning("No data to save!")
-            return
-        
-        # Get all unique fields from the dataset
-        fieldnames = list(set().union(*(grant.keys() for grant in data)))
+        # chunksize=1 keeps slow pages from stalling a batch behind them
+        results = pool.imap_unordered(_worker_scrape, grants, chunksize=1)
+        for index, details in enumerate(results, start=1):
+            logger.info(f"Processed {index}/{len(grants)} with Selenium")
+            if details:
+                writer.write(details)
+    except BaseException:
+        # Each worker's SIGTERM handler quits its browser before the process dies
+        pool.terminate()
+        raise
+    else:
+        # A clean shutdown lets each worker quit its browser
+        pool.close()
+    finally:
+        pool.join()
 
-        with open(filename, "w", newline="", encoding="utf-8") as file:
-            writer = csv.DictWriter(file, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(data)
-        
-        logger.info(f"Successfully saved {len(data)} grants to {filename}")
-    except Exception as e:
-        logger.error(f"Error saving grant details to CSV: {e}")
+# Function to fetch grant details concurrently as a lazy stream
+async def iter_grant_details(grants):
+    """Fetch grant detail pages over HTTP, yielding (grant, details) pairs as they complete."""
+    grants = iter(grants)
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    limits = httpx.Limits(max_connections=MAX_CONCURRENCY, max_keepalive_connections=MAX_CONCURRENCY)
+
+    # HTTP/2 multiplexes the fetches over a few reused connections; httpx already
+    # advertises every compression it can decode (gzip, deflate, br when brotli is installed)
+    async with httpx.AsyncClient(
+        http2=True, limits=limits, timeout=REQUEST_TIMEOUT,
+        headers={"User-Agent": USER_AGENT}, follow_redirects=True
+    ) as client:
+        async def fetch(grant):
+            return grant, await fetch_grant_details(grant, client, semaphore)
+
+        # Only pull more grants from the input as earlier ones finish
+        pending = set()
+        while True:
+            for grant in itertools.islice(grants, MAX_PENDING - len(pending)):
+                pending.add(asyncio.ensure_future(fetch(grant)))
+            if not pending:
+                break
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+
+# Function to fetch all grant details and write them as they arrive
+async def fetch_all_grant_details(grants, writer):
+    """Fetch every grant detail page over HTTP and write it, returning the grants that yielded none."""
+    index = 0
+    needs_js = []
+    async for grant, details in iter_grant_details(grants):
+        index += 1
+        logger.info(f"Processed {index}: {grant['opportunity_number']}")
+        if details:
+            writer.write(details)
+        else:
+            needs_js.append(grant)
+
+    return needs_js
+
+# Argument type for counts that must be at least 1
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {value}")
+    return number
+
+# Parse command line arguments
+def parse_args():
+    arg_parser = argparse.ArgumentParser(description="Scrape grant details from grants.gov")
+    arg_parser.add_argument(
+        "--js", action="store_true",
+        help="Re-scrape pages that yield no details over HTTP with a Selenium browser"
+    )
+    arg_parser.add_argument(
+        "--js-workers", type=positive_int, default=JS_WORKERS,
+        help=f"Number of parallel browsers for --js (default: {JS_WORKERS})"
+    )
+    return arg_parser.parse_args()
 
 # Main function
-def main():
-    driver = setup_driver()
+def main(filename="grant_details.csv"):
+    args = parse_args()
     grants = load_grant_urls()
-    grant_details = []
 
-    for index, grant in enumerate(grants, start=1):
-        logger.info(f"Processing {index}/{len(grants)}: {grant['opportunity_number']}")
-        details = scrape_grant_details(grant, driver)
-        if details:
-            grant_details.append(details)
-        
-        if index % 10 == 0:  # Save every 10 grants to avoid data loss
-            save_to_csv(grant_details)
+    # The output file is only created once a grant has been scraped, so a failed run leaves it untouched
+    with GrantDetailsWriter(filename) as writer:
+        needs_js = asyncio.run(fetch_all_grant_details(grants, writer))
+
+        if needs_js and args.js:
+            logger.info(f"Re-scraping {len(needs_js)} grants with {args.js_workers} Selenium workers")
+            scrape_all_with_browsers(needs_js, writer, args.js_workers)
+        elif needs_js:
+            logger.warning(f"{len(needs_js)} grants yielded no details over HTTP; rerun with --js to render them in a browser")
 
-    driver.quit()
-    save_to_csv(grant_details)  # Final save
+    if writer.saved:
+        logger.info(f"Successfully saved {writer.saved} grants to {filename}")
+    else:
+        logger.warning("No data to save!")
 
 if __name__ == "__main__":
     main()
@@ -4,14 +4,19 @@ from selenium.webdriver.firefox.service import Service
 from selenium.webdriver.firefox.options import Options
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import NoSuchElementException, StaleElementReferenceException, TimeoutException
 import csv
 import logging
 import time
+from parser import parse_grant_links
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+RESULTS_TABLE_SELECTOR = ".usa-table-container--scrollable table"
+FIRST_LINK_SELECTOR = f"{RESULTS_TABLE_SELECTOR} tbody tr td a.usa-link"
+
 # Setup WebDriver for Firefox
 def setup_driver():
     """Set up and return the Firefox WebDriver with anti-bot detection measures."""
@@ -88,33 +93,32 @@ def scrape_grants():
             logger.info(f"Scraping page {page_num}")
 
             # Wait for the grants table to be populated
-            table = wait.until(EC.presence_of_element_located(
-                (By.CSS_SELECTOR, ".usa-table-container--scrollable table")
+            wait.until(EC.presence_of_element_located(
+                (By.CSS_SELECTOR, RESULTS_TABLE_SELECTOR)
             ))
             
-            # Get all grant rows
-            rows = table.find_elements(By.CSS_SELECTOR, "tbody tr")
-            logger.info(f"Found {len(rows)} grants on page {page_num}")
-
-            if not rows:
+            # Pull the table HTML in one WebDriver call and parse it locally
+            table_html = driver.execute_script(
+                "return document.querySelector(arguments[0]).outerHTML;", RESULTS_TABLE_SELECTOR
+            )
+            links = parse_grant_links(table_html)
+            logger.info(f"Found {len(links)} grants on page {page_num}")
+
+            if not links:
                 logger.warning("No rows found, something is wrong.")
                 break
 
-            for row in rows:
-                try:
-                    link_element = row.find_element(By.CSS_SELECTOR, "td a.usa-link")
-                    opportunity_number = link_element.text.strip()
-                    url_suffix = link_element.get_attribute("href")
-                    full_url = f"https://grants.gov{url_suffix}" if url_suffix.startswith('/') else url_suffix
-                    grants.append((opportunity_number, full_url))
-                    logger.debug(f"Found grant: {opportunity_number}")
-                except Exception as e:
-                    logger.warning(f"Error processing row: {e}")
-                    continue
+            for opportunity_number, url_suffix in links:
+                full_url = f"https://grants.gov{url_suffix}" if url_suffix.startswith('/') else url_suffix
+                grants.append((opportunity_number, full_url))
+                logger.debug("Found grant: %s", opportunity_number)
 
             # Attempt to trigger pagination using JavaScript instead of clicking
             try:
                 logger.info("Manually triggering next page event...")
+
+                # Capture the rendered first grant, read the same way as the wait below
+                old_first = driver.find_element(By.CSS_SELECTOR, FIRST_LINK_SELECTOR).text.strip()
                 
                 # Execute JavaScript to manually call the event that loads the next page
                 pagination_result = driver.execute_script("""
@@ -143,7 +147,17 @@ def scrape_grants():
                     logger.info("Next button is disabled - reached last page")
                     break
                 elif pagination_result == "CLICKED":
-                    time.sleep(3)  # Small delay for UI update
+                    # Wait until the table re-renders with a different first grant
+                    try:
+                        WebDriverWait(
+                            driver, 10,
+                            ignored_exceptions=(NoSuchElementException, StaleElementReferenceException)
+                        ).until(
+                            lambda d: d.find_element(By.CSS_SELECTOR, FIRST_LINK_SELECTOR).text.strip() != old_first
+                        )
+                    except TimeoutException:
+                        logger.error(f"Results did not change after requesting page {page_num + 1}")
+                        break
                     page_num += 1
                     logger.info(f"Successfully navigated to page {page_num}")
                 else:
@@ -1,6 +1,8 @@
 """
 Utility functions for logging and error handling.
 """
+import asyncio
+import inspect
 import logging
 import time
 from functools import wraps
@@ -33,15 +35,36 @@ def setup_logger(name: str, level=logging.INFO) -> logging.Logger:
 
 logger = setup_logger(__name__)
 
-def retry_request(max_retries: int = 3, delay: float = 2.0):
+def retry_request(max_retries: int = 3, delay: float = 2.0, should_retry=None):
     """
     Retry a function if it fails, with a fixed delay.
+    Coroutine functions are retried without blocking the event loop.
 
     Args:
         max_retries: Maximum number of retry attempts.
         delay: Seconds to wait between retries.
+        should_retry: Optional predicate taking the raised exception; errors it
+            rejects are re-raised immediately. Defaults to retrying every error.
     """
     def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                retries = 0
+                while retries < max_retries:
+                    try:
+                        return await func(*args, **kwargs)
+                    except Exception as e:
+                        if should_retry is not None and not should_retry(e):
+                            raise
+                        retries += 1
+                        logger.warning(f"Retry {retries}/{max_retries} for {func.__name__} after error: {e}")
+                        if retries == max_retries:
+                            logger.error(f"Max retries reached for {func.__name__}")
+                            raise
+                        await asyncio.sleep(delay)
+            return async_wrapper
+
         @wraps(func)
         def wrapper(*args, **kwargs):
             retries = 0
@@ -49,6 +72,8 @@ def retry_request(max_retries: int = 3, delay: float = 2.0):
                 try:
                     return func(*args, **kwargs)
                 except Exception as e:
+                    if should_retry is not None and not should_retry(e):
+                        raise
                     retries += 1
                     logger.warning(f"Retry {retries}/{max_retries} for {func.__name__} after error: {e}")
                     time.sleep(delay)
@@ -65,17 +90,17 @@ def rate_limit(min_delay: float = 1.0):
     Args:
         min_delay: Minimum delay in seconds between calls.
     """
-    last_called = {}
-
     def decorator(func):
+        # Monotonic timestamp of the last call, held per decorated function
+        last_called = [float("-inf")]
+
         @wraps(func)
         def wrapper(*args, **kwargs):
-            now = time.time()
-            elapsed = now - last_called.get(func.__name__, 0)
-            if elapsed < min_delay:
-                time.sleep(min_delay - elapsed)
+            remaining = min_delay - (time.monotonic() - last_called[0])
+            if remaining > 0:
+                time.sleep(remaining)
             result = func(*args, **kwargs)
-            last_called[func.__name__] = time.time()
+            last_called[0] = time.monotonic()
             return result
         return wrapper
     return decorator